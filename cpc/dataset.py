@@ -3,20 +3,24 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 import os
+import atexit
+import bisect
+import queue
 import random
+import threading
 import time
 import tqdm
+import numpy as np
 import torch
 import soundfile as sf
 from pathlib import Path
 from copy import deepcopy
-from torch.multiprocessing import Pool
+import torch.multiprocessing as mp
 from multiprocessing import dummy
 from torch.utils.data import Dataset, DataLoader
 from torch.utils.data.sampler import Sampler, BatchSampler
-import torchaudio
 
-from typing import Sequence, Tuple
+from typing import Tuple
 
 class AudioBatchData(Dataset):
 
@@ -27,8 +31,10 @@ class AudioBatchData(Dataset):
                  phoneLabelsDict,
                  nSpeakers,
                  wordLabelsDict=None,
-                 nProcessLoader=50,
-                 MAX_SIZE_LOADED=4000000000):
+                 nProcessLoader=None,
+                 MAX_SIZE_LOADED=4000000000,
+                 useThreadPool=False,
+                 prefetchPack=True):
         """
         Args:
             - path (string): path to the training dataset
@@ -42,16 +48,37 @@ class AudioBatchData(Dataset):
                                              the sequence $SEQ_NAME
            - nSpeakers (int): number of speakers to expect.
            - nProcessLoader (int): number of processes to call when loading the
-                                   data from the disk
-           - MAX_SIZE_LOADED (int): target maximal size of the floating array
+                                   data from the disk. If None, use
+                                   os.cpu_count()
+           - MAX_SIZE_LOADED (int): target maximal size of the int16 array
                                     containing all loaded data.
+           - useThreadPool (bool): if True load the data with a thread pool
+                                   instead of worker processes (debugging)
+           - prefetchPack (bool): if True the next pack is loaded and
+                                  assembled on a background thread while
+                                  the current one is being used
         """
         self.MAX_SIZE_LOADED = MAX_SIZE_LOADED
+        if nProcessLoader is None:
+            nProcessLoader = os.cpu_count()
         self.nProcessLoader = nProcessLoader
         self.sizeWindow = sizeWindow
-        self.seqNames = [(s, Path(x)) for s, x in seqNames]
-        #self.reload_pool = Pool(nProcessLoader)
-        self.reload_pool = dummy.Pool(nProcessLoader)
+        self.path = path
+        # Sequences are stored as parallel arrays of speakers and paths
+        self.seqSpeakers = np.fromiter((s for s, _ in seqNames),
+                                       dtype=np.int32, count=len(seqNames))
+        self.seqPaths = [str(x) for _, x in seqNames]
+        self.seqLengths = None
+        # Decoding holds the GIL, so real processes are needed to load
+        # files in parallel. loadFile returns numpy arrays, which pickle
+        # cleanly back to the main process. Spawning workers is slow, so
+        # every dataset shares the same pool (see getLoaderPool)
+        if useThreadPool:
+            self.reload_pool = dummy.Pool(nProcessLoader)
+        else:
+            self.reload_pool = getLoaderPool(nProcessLoader)
+        self.prefetchPack = prefetchPack
+        self.packQueue = queue.Queue(maxsize=1)
 
         self.prepare()
         self.speakers = list(range(nSpeakers))
@@ -73,9 +100,18 @@ class AudioBatchData(Dataset):
         self.doubleLabels = False
 
     def resetPhoneLabels(self, newPhoneLabels, step):
+        # The pack being prefetched was built with the previous labels,
+        # drop it and load it again once the new labels are set
+        if self.prefetchPack:
+            self.packQueue.get()
+            self.prefetchThread.join()
         self.phoneSize = step
         self.phoneStep = self.sizeWindow // self.phoneSize
         self.phoneLabelsDict = deepcopy(newPhoneLabels)
+        if self.prefetchPack:
+            seqStart, seqEnd = self.packageIndex[self.nextPack]
+            self.startLoadingPack(self.seqSpeakers[seqStart:seqEnd],
+                                  self.seqPaths[seqStart:seqEnd])
         self.loadNextPack()
 
     def splitSeqTags(seqName):
@@ -83,7 +119,7 @@ class AudioBatchData(Dataset):
         return path.split(os.sep)
 
     def getSeqNames(self):
-        return [str(x[1]) for x in self.seqNames]
+        return list(self.seqPaths)
 
     def clear(self):
         if 'data' in self.__dict__:
@@ -96,17 +132,27 @@ class AudioBatchData(Dataset):
             del self.wordLabels
         if 'seqLabel' in self.__dict__:
             del self.seqLabel
+        if 'speakerOfWindow' in self.__dict__:
+            del self.speakerOfWindow
+        if 'seqOfWindow' in self.__dict__:
+            del self.seqOfWindow
 
     def prepare(self):
         randomstate = random.getstate()
         random.seed(767543)  # set seed only for batching so that it is random but always same for same dataset
                              # so that capturing captures data for same audio across runs if same dataset provided
-        random.shuffle(self.seqNames)
+        order = list(range(len(self.seqPaths)))
+        random.shuffle(order)
         random.setstate(randomstate)  # restore random state so that other stuff changes with seed in args
+        self.seqSpeakers = self.seqSpeakers[order]
+        self.seqPaths = [self.seqPaths[i] for i in order]
         start_time = time.time()
 
         print("Checking length...")
-        allLength = self.reload_pool.map(extractLength, self.seqNames)
+        if self.seqLengths is None:
+            self.seqLengths = getSeqLengths(self.path, self.seqPaths,
+                                            self.reload_pool)
+        allLength = [self.seqLengths[x] for x in self.seqPaths]
 
         self.packageIndex, self.totSize = [], 0
         start, packageSize = 0, 0
@@ -118,11 +164,11 @@ class AudioBatchData(Dataset):
                 start, packageSize = index, 0
 
         if packageSize > 0:
-            self.packageIndex.append([start, len(self.seqNames)])
+            self.packageIndex.append([start, len(self.seqPaths)])
             self.totSize += packageSize
 
         print(f"Done, elapsed: {time.time() - start_time:.3f} seconds")
-        print(f'Scanned {len(self.seqNames)} sequences '
+        print(f'Scanned {len(self.seqPaths)} sequences '
               f'in {time.time() - start_time:.2f} seconds')
         print(f"{len(self.packageIndex)} chunks computed")
         self.currentPack = -1
@@ -137,33 +183,80 @@ class AudioBatchData(Dataset):
             self.currentPack = self.nextPack
             start_time = time.time()
             print('Joining pool')
-            self.r.wait()
+            pack = self.getNextPack()
             print(f'Joined process, elapsed={time.time()-start_time:.3f} secs')
-            self.nextData = self.r.get()
-            self.parseNextDataBlock()
-            del self.nextData
+            self.data = pack['data']
+            self.speakerLabel = pack['speakerLabel']
+            self.seqLabel = pack['seqLabel']
+            self.phoneLabels = pack['phoneLabels']
+            self.wordLabels = pack['wordLabels']
+            self.speakerOfWindow = pack['speakerOfWindow']
+            self.seqOfWindow = pack['seqOfWindow']
+            del pack
+        # Last intervals found by getSpeakerLabel / getSeqIdx
+        self._speakerCache = (0, 0, -1)
+        self._seqCache = (0, 0, -1)
         self.nextPack = (self.currentPack + 1) % (len(self.packageIndex))
         seqStart, seqEnd = self.packageIndex[self.nextPack]
         if self.nextPack == 0 and len(self.packageIndex) > 1:
             self.prepare()
-        self.r = self.reload_pool.map_async(loadFile,
-                                            self.seqNames[seqStart:seqEnd])
+        self.startLoadingPack(self.seqSpeakers[seqStart:seqEnd],
+                              self.seqPaths[seqStart:seqEnd])
 
-    def parseNextDataBlock(self):
+    def startLoadingPack(self, seqSpeakers, seqPaths):
+        r"""
+        Start loading the given sequences in the background. If prefetchPack
+        is set, the pack tensor is also assembled on a background thread so
+        that getNextPack does not have to wait for it.
+        """
+        couples = list(zip(seqSpeakers.tolist(), seqPaths))
+        if not self.prefetchPack:
+            self.r = self.reload_pool.starmap_async(loadFile, couples)
+            return
+
+        def prefetch():
+            try:
+                pack = self.parseNextDataBlock(
+                    self.reload_pool.starmap(loadFile, couples))
+            except Exception as err:
+                pack = err
+            self.packQueue.put(pack)
+
+        self.prefetchThread = threading.Thread(target=prefetch, daemon=True)
+        self.prefetchThread.start()
+
+    def getNextPack(self):
+        if not self.prefetchPack:
+            self.r.wait()
+            return self.parseNextDataBlock(self.r.get())
+        pack = self.packQueue.get()
+        self.prefetchThread.join()
+        if isinstance(pack, Exception):
+            raise pack
+        return pack
+
+    def parseNextDataBlock(self, nextData):
+        r"""
+        Build a pack from the output of loadFile. Only local state is
+        modified so that this can run concurrently with the training loop.
+        Output:
+            A dictionary with entries data, speakerLabel, seqLabel,
+            phoneLabels and wordLabels
+        """
 
         # Labels
-        self.speakerLabel = [0]
-        self.seqLabel = [0]
-        self.phoneLabels = []
-        self.wordLabels = []
+        speakerLabel = [0]
+        seqLabel = [0]
+        phoneLabels = []
+        wordLabels = []
         speakerSize = 0
         indexSpeaker = 0
 
         # To accelerate the process a bit
-        self.nextData.sort(key=lambda x: (x[0], x[1]))
-        tmpData = []
+        nextData.sort(key=lambda x: (x[0], x[1]))
+        keptSeqs = []
 
-        for speaker, seqName, seq in self.nextData:
+        for indexSeq, (speaker, seqName, seq) in enumerate(nextData):
 
             # sometimes some data may be missing
             if (self.phoneLabelsDict is not None and seqName not in self.phoneLabelsDict) \
@@ -172,26 +265,46 @@ class AudioBatchData(Dataset):
             
             while self.speakers[indexSpeaker] < speaker:
                 indexSpeaker += 1
-                self.speakerLabel.append(speakerSize)
+                speakerLabel.append(speakerSize)
             if self.speakers[indexSpeaker] != speaker:
                 raise ValueError(f'{speaker} invalid speaker')
             
             if self.wordLabelsDict is not None:
-                self.wordLabels += self.wordLabelsDict[seqName]
+                wordLabels += self.wordLabelsDict[seqName]
             
             if self.phoneLabelsDict is not None:
-                self.phoneLabels += self.phoneLabelsDict[seqName]
+                phoneLabels += self.phoneLabelsDict[seqName]
                 newSize = len(self.phoneLabelsDict[seqName]) * self.phoneSize
                 seq = seq[:newSize]
 
-            sizeSeq = seq.size(0)
-            tmpData.append(seq)
-            self.seqLabel.append(self.seqLabel[-1] + sizeSeq)
+            sizeSeq = seq.shape[0]
+            keptSeqs.append((indexSeq, sizeSeq))
+            seqLabel.append(seqLabel[-1] + sizeSeq)
             speakerSize += sizeSeq
             del seq
 
-        self.speakerLabel.append(speakerSize)
-        self.data = torch.cat(tmpData, dim=0)
+        speakerLabel.append(speakerSize)
+
+        # Copy into a single pre-allocated buffer rather than torch.cat,
+        # releasing each loaded sequence as soon as it has been copied
+        data = torch.empty(seqLabel[-1], dtype=torch.int16)
+        offset = 0
+        for indexSeq, sizeSeq in keptSeqs:
+            seq = nextData[indexSeq][2]
+            data[offset:(offset + sizeSeq)].copy_(
+                torch.from_numpy(seq[:sizeSeq]))
+            nextData[indexSeq] = None
+            offset += sizeSeq
+            del seq
+
+        return {'data': data,
+                'speakerLabel': speakerLabel,
+                'seqLabel': seqLabel,
+                'phoneLabels': phoneLabels,
+                'wordLabels': wordLabels,
+                'speakerOfWindow': getWindowLabels(speakerLabel,
+                                                   self.sizeWindow),
+                'seqOfWindow': getWindowLabels(seqLabel, self.sizeWindow)}
 
     def getPhonem(self, idx):
         idPhone = idx // self.phoneSize
@@ -202,31 +315,36 @@ class AudioBatchData(Dataset):
         return self.wordLabels[idWord:(idWord + self.wordStep)]
 
     def getSeqIdx(self, idx) -> int:
-        label_idx = self.binary_search_max_less(self.seqLabel, idx)
-        return label_idx
+        label = self.seqOfWindow[idx // self.sizeWindow]
+        if label >= 0:
+            return label
+        # Grouped samplers query neighbouring indexes, so the last
+        # [start, end) interval found is checked before searching again
+        lo, hi, label = self._seqCache
+        if lo <= idx < hi:
+            return label
+        # seqLabel is sorted by construction (cumulative sequence sizes)
+        label = bisect.bisect_right(self.seqLabel, idx) - 1
+        if label + 1 < len(self.seqLabel):
+            self._seqCache = (self.seqLabel[label],
+                              self.seqLabel[label + 1], label)
+        return label
     
     def getSeqName(self, seqIdx) -> Tuple[int, Path]:
-        return self.seqNames[seqIdx]
-
-    def binary_search_max_less(self, a: Sequence[int], tgt: int, i: int=0) -> int:
-        """
-        Given list of numbers a and target value tgt,
-        return the largest index whose value is less than tgt.
-        """
-        if len(a) == 1:
-            return i
-
-        mid_i = len(a)//2
-        if a[mid_i] > tgt:
-            return self.binary_search_max_less(a[:mid_i], tgt, i)
-        if a[mid_i] < tgt:
-            return self.binary_search_max_less(a[mid_i:], tgt, i+mid_i)
-        return i+mid_i
+        return int(self.seqSpeakers[seqIdx]), Path(self.seqPaths[seqIdx])
 
     def getSpeakerLabel(self, idx):
-        idSpeaker = next(x[0] for x in enumerate(
-            self.speakerLabel) if x[1] > idx) - 1
-        return idSpeaker
+        label = self.speakerOfWindow[idx // self.sizeWindow]
+        if label >= 0:
+            return label
+        lo, hi, label = self._speakerCache
+        if lo <= idx < hi:
+            return label
+        label = bisect.bisect_right(self.speakerLabel, idx) - 1
+        if label + 1 < len(self.speakerLabel):
+            self._speakerCache = (self.speakerLabel[label],
+                                  self.speakerLabel[label + 1], label)
+        return label
 
     def __len__(self):
         # all audio is glued together, totSize is num of frames and sizeWindow is perhaps sample size
@@ -237,7 +355,8 @@ class AudioBatchData(Dataset):
         if idx < 0 or idx >= len(self.data) - self.sizeWindow - 1:
             print(idx)
 
-        outData = self.data[idx:(self.sizeWindow + idx)].view(1, -1)
+        outData = self.data[idx:(self.sizeWindow + idx)].to(torch.float32) \
+            .mul_(1.0 / 32768.0).view(1, -1)
         labelData = {}
         labelData['speaker'] = torch.tensor(self.getSpeakerLabel(idx), dtype=torch.long)
         labelData['seqIdx'] = torch.tensor(self.getSeqIdx(idx), dtype=torch.long)
@@ -267,19 +386,28 @@ class AudioBatchData(Dataset):
     def getNLoadsPerEpoch(self):
         return len(self.packageIndex)
 
-    def getBaseSampler(self, type, batchSize, offset):
+    def getSamplerFactory(self, type, batchSize):
+        r"""
+        Resolve the sampler type once and return a function building the
+        batch sampler from an offset. Labels and data are read when the
+        function is called, since they change with each loaded pack.
+        """
+        sizeWindow = self.sizeWindow
         if type == "samespeaker":
-            return SameSpeakerSampler(batchSize, self.speakerLabel,
-                                      self.sizeWindow, offset)
+            return lambda offset: SameSpeakerSampler(
+                batchSize, self.speakerLabel, sizeWindow, offset)
         if type == "samesequence":
-            return SameSpeakerSampler(batchSize, self.seqLabel,
-                                      self.sizeWindow, offset)
+            return lambda offset: SameSpeakerSampler(
+                batchSize, self.seqLabel, sizeWindow, offset)
         if type == "sequential":
-            return SequentialSampler(len(self.data), self.sizeWindow,
-                                     offset, batchSize)
-        sampler = UniformAudioSampler(len(self.data), self.sizeWindow,
-                                      offset)
-        return BatchSampler(sampler, batchSize, True)
+            return lambda offset: SequentialSampler(
+                len(self.data), sizeWindow, offset, batchSize)
+        return lambda offset: BatchSampler(
+            UniformAudioSampler(len(self.data), sizeWindow, offset),
+            batchSize, True)
+
+    def getBaseSampler(self, type, batchSize, offset):
+        return self.getSamplerFactory(type, batchSize)(offset)
 
     def getDataLoader(self, batchSize, type, randomOffset, numWorkers=0,
                       onLoop=-1):
@@ -306,27 +434,86 @@ class AudioBatchData(Dataset):
             self.loadNextPack()
             nLoops = 1
 
+        makeSampler = self.getSamplerFactory(type, batchSize)
+        maxOffset = self.sizeWindow // 2
+
         def samplerCall():
-            offset = random.randint(0, self.sizeWindow // 2) \
-                if randomOffset else 0
-            return self.getBaseSampler(type, batchSize, offset)
+            offset = random.randint(0, maxOffset) if randomOffset else 0
+            return makeSampler(offset)
 
         return AudioLoader(self, samplerCall, nLoops, self.loadNextPack,
                            totSize, numWorkers)
 
 
-def loadFile(data):
-    speaker, fullPath = data
-    seqName = fullPath.stem
+def getWindowLabels(boundaries, sizeWindow):
+    r"""
+    Given the sorted start offsets of the labelled intervals of a pack
+    (ending with the pack size), return for each block
+    [k * sizeWindow, (k + 1) * sizeWindow) the index of the interval
+    containing it, or -1 if the block overlaps several intervals.
+    """
+    boundaries = np.asarray(boundaries, dtype=np.int64)
+    blockStarts = np.arange(0, max(boundaries[-1], 1), sizeWindow)
+    labelStart = np.searchsorted(boundaries, blockStarts, side='right') - 1
+    labelEnd = np.searchsorted(boundaries, blockStarts + sizeWindow - 1,
+                               side='right') - 1
+    return np.where(labelStart == labelEnd, labelStart, -1).tolist()
+
+
+def loadFile(speaker, fullPath):
+    seqName = os.path.splitext(os.path.basename(fullPath))[0]
 
     # Due to some issues happening when combining torchaudio.load
-    # with torch.multiprocessing we use soundfile to load the data
-    seq = torch.tensor(sf.read(str(fullPath))[0]).float()
-    if len(seq.size()) == 2:
-        seq = seq.mean(dim=1)
+    # with torch.multiprocessing we use soundfile to load the data.
+    # The array is copied straight into the pack tensor by
+    # parseNextDataBlock, so no intermediate tensor is built here
+    # Samples are kept as int16 in the pack and only converted to float in
+    # __getitem__; channels are averaged in int32 to avoid overflows
+    if sf.info(fullPath).subtype in ('FLOAT', 'DOUBLE'):
+        # libsndfile does not rescale float files read as int16, so
+        # downmix and scale them here instead of letting them round to 0
+        seq, _ = sf.read(fullPath, dtype='float32', always_2d=False)
+        if seq.ndim == 2:
+            seq = seq.mean(axis=1)
+        seq = np.clip(np.round(seq * 32768), -32768, 32767).astype(np.int16)
+        return speaker, seqName, seq
+    seq, _ = sf.read(fullPath, dtype='int16', always_2d=False)
+    if seq.ndim == 2:
+        seq = (seq.astype(np.int32).sum(axis=1)
+               // seq.shape[1]).astype(np.int16)
     return speaker, seqName, seq
 
 
+_loaderPools = {}
+
+
+def getLoaderPool(nProcessLoader):
+    r"""
+    Return the spawn process pool with nProcessLoader workers used to load
+    audio files, creating it on first use. The pool is shared by every
+    AudioBatchData asking for the same number of workers and stays alive
+    until closeLoaderPools is called or the interpreter exits.
+    """
+    pool = _loaderPools.get(nProcessLoader)
+    if pool is None:
+        pool = mp.get_context('spawn').Pool(nProcessLoader)
+        _loaderPools[nProcessLoader] = pool
+    return pool
+
+
+def closeLoaderPools():
+    r"""
+    Terminate the worker pools created by getLoaderPool.
+    """
+    for pool in _loaderPools.values():
+        pool.terminate()
+        pool.join()
+    _loaderPools.clear()
+
+
+atexit.register(closeLoaderPools)
+
+
 class AudioLoader(object):
     r"""
     A DataLoader meant to handle an AudioBatchData object.
@@ -366,7 +553,8 @@ class AudioLoader(object):
             sampler = self.samplerCall()
             dataloader = DataLoader(self.dataset,
                                     batch_sampler=sampler,
-                                    num_workers=self.numWorkers)
+                                    num_workers=self.numWorkers,
+                                    pin_memory=torch.cuda.is_available())
             for x in dataloader:
                 yield x
             if i < self.nLoop - 1:
@@ -440,19 +628,17 @@ class SameSpeakerSampler(Sampler):
         if self.offset > 0:
             self.sizeSamplers = [max(0, x - 1) for x in self.sizeSamplers]
 
-        order = [(x, torch.randperm(val).tolist())
-                 for x, val in enumerate(self.sizeSamplers) if val > 0]
-
         # Build Batches
         self.batches = []
-        for indexSampler, randperm in order:
-            indexStart, sizeSampler = 0, self.sizeSamplers[indexSampler]
-            while indexStart < sizeSampler:
-                indexEnd = min(sizeSampler, indexStart + self.batchSize)
-                locBatch = [self.getIndex(x, indexSampler)
-                            for x in randperm[indexStart:indexEnd]]
-                indexStart = indexEnd
-                self.batches.append(locBatch)
+        for indexSampler, sizeSampler in enumerate(self.sizeSamplers):
+            if sizeSampler == 0:
+                continue
+            indices = self.offset + self.samplingIntervals[indexSampler] \
+                + self.sizeWindow * torch.randperm(sizeSampler)
+            sizeFull = (sizeSampler // self.batchSize) * self.batchSize
+            self.batches += indices[:sizeFull].view(-1, self.batchSize).tolist()
+            if sizeFull < sizeSampler:
+                self.batches.append(indices[sizeFull:].tolist())
 
     def __len__(self):
         return len(self.batches)
@@ -466,12 +652,135 @@ class SameSpeakerSampler(Sampler):
         return iter(self.batches)
 
 
-def extractLength(couple):
-    speaker, locPath = couple
-    info = torchaudio.info(str(locPath))
-    # info = torchaudio.info(str(locPath)) [0]
-    # return info.length
-    return info.num_frames
+def extractLength(locPath):
+    # libsndfile only parses the header here, much cheaper than
+    # going through a torchaudio backend
+    return sf.info(locPath).frames
+
+
+def loadLengthCache(cache_path):
+    r"""
+    Read a sequence length cache written by saveLengthCache.
+    Output:
+        A dictionary seq_path -> (file_size, mtime_ns, num_frames)
+    """
+    output = {}
+    if not os.path.isfile(cache_path):
+        return output
+    try:
+        with open(cache_path, 'r') as f:
+            for line in f:
+                seqPath, size, mtime, nFrames = line.rstrip('\n').split('\t')
+                output[seqPath] = (int(size), int(mtime), int(nFrames))
+    except (OSError, ValueError) as err:
+        print(f'Ran in an error while loading {cache_path}: {err}')
+        return {}
+    return output
+
+
+def _writeLinesAtomic(path, lines):
+    r"""
+    Write lines to a temporary file next to path and move it over path, so
+    that an interrupted run never leaves a truncated file behind.
+    """
+    tmpPath = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(tmpPath, 'w') as f:
+            f.writelines(lines)
+        os.replace(tmpPath, path)
+    except BaseException:
+        try:
+            os.remove(tmpPath)
+        except OSError:
+            pass
+        raise
+
+
+def saveLengthCache(cache_path, lengths):
+    try:
+        _writeLinesAtomic(cache_path,
+                          (f'{seqPath}\t{size}\t{mtime}\t{nFrames}\n'
+                           for seqPath, (size, mtime, nFrames)
+                           in lengths.items()))
+    except OSError as err:
+        print(f'Ran in an error while saving {cache_path}: {err}')
+
+
+def getSeqLengths(dirNames, seqPaths, pool):
+    r"""
+    Get the number of frames of each sequence in seqPaths.
+
+    Lengths are memoized in a _lengths_cache.tsv file in each directory of
+    dirNames. A cached value is reused only if the size and modification time
+    of the file did not change, the other sequences are probed with
+    extractLength on the given pool and added to the cache.
+    Output:
+        A dictionary seq_path -> num_frames
+    """
+    if isinstance(dirNames, (str, Path)):
+        dirNames = [dirNames]
+    dirNames = [str(x) for x in dirNames]
+
+    cached = {}
+    for dirName in dirNames:
+        cached.update(loadLengthCache(
+            os.path.join(dirName, '_lengths_cache.tsv')))
+
+    lengths, toProbe, probedStats = {}, [], []
+    for seqPath in seqPaths:
+        try:
+            stat = os.stat(seqPath)
+            fileStat = (stat.st_size, stat.st_mtime_ns)
+        except OSError:
+            fileStat = None
+        entry = cached.get(seqPath)
+        if fileStat is not None and entry is not None \
+                and entry[:2] == fileStat:
+            lengths[seqPath] = entry[2]
+        else:
+            toProbe.append(seqPath)
+            probedStats.append(fileStat)
+
+    if len(toProbe) == 0:
+        return lengths
+
+    for seqPath, fileStat, nFrames in zip(toProbe, probedStats,
+                                          pool.map(extractLength, toProbe)):
+        lengths[seqPath] = nFrames
+        if fileStat is not None:
+            cached[seqPath] = fileStat + (nFrames,)
+
+    for dirName in dirNames:
+        prefix = os.path.join(dirName, '')
+        saveLengthCache(os.path.join(dirName, '_lengths_cache.tsv'),
+                        {k: v for k, v in cached.items()
+                         if k.startswith(prefix)})
+    return lengths
+
+
+def _scanDirectory(dirName, fileExtension):
+    r"""
+    Walk dirName recursively (following symlinks) with os.scandir. For each
+    directory yield its path and the names of the files it contains ending
+    with fileExtension. DirEntry objects carry the file type, so no extra
+    stat call is made per entry.
+    """
+    stack = [dirName]
+    while stack:
+        root = stack.pop()
+        filenames, subdirs = [], []
+        try:
+            with os.scandir(root) as it:
+                for entry in it:
+                    if entry.is_dir():
+                        subdirs.append(entry.path)
+                    elif entry.name.endswith(fileExtension):
+                        filenames.append(entry.name)
+        except OSError:
+            # Skip unreadable or vanished directories, as os.walk does
+            continue
+        yield root, filenames
+        stack.extend(reversed(subdirs))
 
 
 def findAllSeqs(dirNames,
@@ -516,25 +825,23 @@ def findAllSeqs(dirNames,
     outSpeakers = []
     speakersTarget = {}
     for dirName, fileExtension in zip(dirNames, extension):
-        cache_path = os.path.join(dirName, '_seqs_cache.txt')
+        cache_path = os.path.join(dirName, '_seqs_cache.tsv')
         if loadCache:
             try:
-                sequences, speakers = torch.load(cache_path)
+                sequences, speakers = loadSeqsCache(cache_path)
                 print(f'Loaded from cache {cache_path} successfully')
                 outSequences += sequences
                 outSpeakers += speakers
                 continue
-            except OSError as err:
+            except (OSError, ValueError) as err:
                 print(f'Ran in an error while loading {cache_path}: {err}')
             print('Could not load cache, rebuilding')
 
         if dirName[-1] != os.sep:
             dirName += os.sep
         prefixSize = len(dirName)
-        #for root, dirs, filenames in tqdm.tqdm(os.walk(dirName)):
-        for root, dirs, filenames in tqdm.tqdm(os.walk(dirName, followlinks=True)):
-            filtered_files = [f for f in filenames if f.endswith(fileExtension)]
-
+        for root, filtered_files in tqdm.tqdm(_scanDirectory(dirName,
+                                                             fileExtension)):
             if len(filtered_files) > 0:
                 speakerStr = (os.sep).join(
                     root[prefixSize:].split(os.sep)[:speakerLevel])
@@ -550,13 +857,44 @@ def findAllSeqs(dirNames,
             speakers[index] = key
         outSpeakers += speakers
     try:
-        torch.save((outSequences, outSpeakers), cache_path)
+        saveSeqsCache(cache_path, outSequences, outSpeakers)
         print(f'Saved cache file at {cache_path}')
     except OSError as err:
         print(f'Ran in an error while saving {cache_path}: {err}')
     return outSequences, outSpeakers
 
 
+def _speakersCachePath(cache_path):
+    return os.path.join(os.path.dirname(cache_path), '_speakers_cache.txt')
+
+
+def loadSeqsCache(cache_path):
+    r"""
+    Load a sequence cache written by saveSeqsCache: cache_path holds one
+    speaker_index<TAB>seq_path line per sequence, and the speaker labels are
+    stored one per line, in order, in a sibling _speakers_cache.txt file.
+    """
+    sequences = []
+    with open(cache_path, 'r') as f:
+        for line in f:
+            speaker, seqPath = line.rstrip('\n').split('\t', 1)
+            sequences.append((int(speaker), seqPath))
+    with open(_speakersCachePath(cache_path), 'r') as f:
+        speakers = f.read().split('\n')[:-1]
+    if any(speaker >= len(speakers) for speaker, _ in sequences):
+        raise ValueError('sequence and speaker caches do not match')
+    return sequences, speakers
+
+
+def saveSeqsCache(cache_path, sequences, speakers):
+    # findAllSeqs looks for cache_path, so it is written last
+    _writeLinesAtomic(_speakersCachePath(cache_path),
+                      (f'{speaker}\n' for speaker in speakers))
+    _writeLinesAtomic(cache_path,
+                      (f'{speaker}\t{seqPath}\n'
+                       for speaker, seqPath in sequences))
+
+
 def parseSeqLabels(pathLabels):
     with open(pathLabels, 'r') as f:
         lines = f.readlines()
@@ -146,7 +146,7 @@ def trainStep(dataLoader,
     n_examples = 0
     logs, lastlogs = {}, None
     iter = 0
-    for step, fulldata in enumerate(dataLoader):
+    for step, fulldata in enumerate(utils.prefetchToCuda(dataLoader)):
         Globals.currentIteration += 1
         batchData, labelData = fulldata
         label = labelData['speaker'] if PhoneLabels is None else labelData['phone']
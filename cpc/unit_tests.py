@@ -6,7 +6,7 @@ import unittest
 import torch
 import os
 import cpc.feature_loader as fl
-from .dataset import AudioBatchData, findAllSeqs, filterSeqs
+from .dataset import AudioBatchData, SameSpeakerSampler, findAllSeqs, filterSeqs
 from nose.tools import eq_, ok_
 from math import log
 from pathlib import Path
@@ -170,6 +170,30 @@ class TestDataLoader(unittest.TestCase):
         eq_(len(visted_labels), 4)
 
 
+class TestSameSpeakerSampler(unittest.TestCase):
+
+    def testBatches(self):
+        size_window = 10
+        batch_size = 4
+        intervals = [0, 75, 75, 120]
+        offset = 2
+        sampler = SameSpeakerSampler(batch_size, intervals, size_window,
+                                     offset)
+
+        # 6 then 3 windows once the offset is taken into account
+        eq_(sorted(len(b) for b in sampler), [2, 3, 4])
+        all_indices = set()
+        for batch in sampler:
+            starts = {next(i for i in range(len(intervals) - 1)
+                           if intervals[i] <= x < intervals[i + 1])
+                      for x in batch}
+            eq_(len(starts), 1)
+            all_indices.update(batch)
+        expected = {offset + x * size_window for x in range(6)} | \
+            {offset + 75 + x * size_window for x in range(3)}
+        eq_(all_indices, expected)
+
+
 class TestPhonemParser(unittest.TestCase):
 
     def setUp(self):
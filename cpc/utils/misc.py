@@ -337,6 +337,55 @@ def show_logs(text, logs):
     print('-'*50)
 
 
+def prefetchToCuda(loader):
+    r"""
+    Iterate over loader, copying the next batch to the GPU on a side stream
+    while the current one is being processed. Tensors nested in lists, tuples
+    and dicts are moved; batches should come from pinned memory for the copy
+    to be asynchronous.
+    """
+    stream = torch.cuda.Stream()
+
+    def toCuda(x):
+        if torch.is_tensor(x):
+            return x.cuda(non_blocking=True)
+        if isinstance(x, dict):
+            return {k: toCuda(v) for k, v in x.items()}
+        if isinstance(x, (list, tuple)):
+            return type(x)(toCuda(v) for v in x)
+        return x
+
+    def recordStream(x):
+        # Keep the caching allocator from reusing the memory of tensors
+        # copied on the side stream while the main stream still uses them
+        if torch.is_tensor(x):
+            x.record_stream(torch.cuda.current_stream())
+        elif isinstance(x, dict):
+            for v in x.values():
+                recordStream(v)
+        elif isinstance(x, (list, tuple)):
+            for v in x:
+                recordStream(v)
+
+    iterator = iter(loader)
+
+    def preload():
+        try:
+            batch = next(iterator)
+        except StopIteration:
+            return None
+        with torch.cuda.stream(stream):
+            return toCuda(batch)
+
+    nextBatch = preload()
+    while nextBatch is not None:
+        torch.cuda.current_stream().wait_stream(stream)
+        batch = nextBatch
+        recordStream(batch)
+        nextBatch = preload()
+        yield batch
+
+
 def set_seed(seed):
     random.seed(seed)
     torch.manual_seed(seed)
@@ -10,76 +10,149 @@ import argparse
 from scipy.interpolate import interp1d
 import os
 import pandas as pd
-from typing import List, Tuple, Optional, Sequence
+from multiprocessing import Pool
+from typing import Iterator, List, Tuple, Optional, Sequence
 from tqdm import tqdm
 
-def get_segments(np_array: np.ndarray) -> Tuple[List[Tuple[int, int]], int]:
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+if njit is not None:
+    @njit(cache=True)
+    def _scan_clipping(x: np.ndarray, lo, hi) -> Tuple[np.ndarray, np.ndarray, int, int]:
+        """
+        Single pass over the samples, counting those <= lo or >= hi as clipped:
+        return start and end index buffers, the number of clipped segments found
+        and the number of clipped samples.
+        """
+        starts = np.empty(x.size // 2 + 1, dtype=np.int64)
+        ends = np.empty(x.size // 2 + 1, dtype=np.int64)
+        n_segments = 0
+        clipped = 0
+        inside_clip = False
+        for i in range(x.size):
+            s = x[i]
+            if s <= lo or s >= hi:
+                clipped += 1
+                if not inside_clip:
+                    inside_clip = True
+                    starts[n_segments] = i
+            elif inside_clip:
+                inside_clip = False
+                ends[n_segments] = i-1
+                n_segments += 1
+        if inside_clip:
+            ends[n_segments] = x.size-1
+            n_segments += 1
+        return starts, ends, n_segments, clipped
+
+def get_clip_bounds(np_array: np.ndarray) -> Tuple[float, float]:
+    """
+    Given numpy array representing audio samples
+    return the (lo, hi) thresholds at or beyond which a sample counts as clipped.
+    """
+    # use python scalars so nmax - 1 / nmin + 1 cannot overflow on int16 input
+    # and are not truncated on float input
+    nmax = np_array.max().item()
+    nmin = np_array.min().item()
+    return nmin + 1, nmax - 1
+
+def get_clipped_mask(np_array: np.ndarray) -> np.ndarray:
+    """
+    Given numpy array representing audio samples
+    return a boolean array marking samples equal to or extremely close to max or min.
+    """
+    lo, hi = get_clip_bounds(np_array)
+    return (np_array <= lo) | (np_array >= hi)
+
+def get_percent_clipped(np_array: np.ndarray) -> float:
+    """
+    Given numpy array representing audio samples
+    return the fraction of samples which are clipped, without building segments.
+    Multi-channel arrays are counted over all of their samples.
+    """
+    if njit is not None:
+        # the kernel walks a flat array, the ratio does not depend on layout
+        _, _, _, clipped = _scan_clipping(np_array.reshape(-1), *get_clip_bounds(np_array))
+        return clipped / np_array.size
+    return float(get_clipped_mask(np_array).mean())
+
+def get_segments(np_array: np.ndarray) -> Tuple[List[Tuple[int, int]], float]:
     """
     Given numpy array representing audio samples
     return a list of tuples containing beginning and end indices of clipped segments,
-    and an integer indicating the percentage of samples which are clipped.
+    and a float indicating the percentage of samples which are clipped.
+    Only 1-D (mono) arrays are supported.
     """
-    nmax = max(np_array)
-    nmin = min(np_array)
-
-    clipped_segments = []
-    clipped_samples = 0
-    inside_clip = False
-    clip_start = 0
-    clip_end = 0
-
-    for i, sample in enumerate(np_array):
-        if (sample <= nmin + 1) or (sample >= nmax - 1):  # sample equal to or extremely close to max or min
-            if not inside_clip:
-                inside_clip = True  # declare we are inside clipped segment
-                clip_start = i  # this is the first clipped sample
-
-        elif inside_clip:
-            inside_clip = False  # not longer inside clipped segment
-            clip_end = i-1  # previous sample is end of segment
-            clipped_segment = (clip_start, clip_end)  # save segment as tuple
-            clipped_samples += clip_end-clip_start+1 # save number of samples in segment
-            clipped_segments.append(clipped_segment)  # store tuple in list of clipped segments
-
-    percent_clipped = clipped_samples / len(np_array)
+    if np_array.ndim != 1:
+        raise ValueError(f"get_segments expects a 1-D array, got shape {np_array.shape}")
+    if njit is not None:
+        starts, ends, n_segments, clipped = _scan_clipping(np_array, *get_clip_bounds(np_array))
+        clipped_segments = list(zip(starts[:n_segments].tolist(), ends[:n_segments].tolist()))
+        return clipped_segments, clipped / np_array.size
+
+    mask = get_clipped_mask(np_array)
+
+    # +1 where a clipped run begins, -1 on the sample after a run ends
+    edges = np.diff(mask.astype(np.int8))
+    starts = np.flatnonzero(edges == 1) + 1
+    ends = np.flatnonzero(edges == -1)
+    if mask[0]:
+        starts = np.concatenate(([0], starts))
+    if mask[-1]:
+        ends = np.concatenate((ends, [mask.size-1]))
+
+    clipped_segments = list(zip(starts.tolist(), ends.tolist()))
+    percent_clipped = mask.sum() / mask.size
     return clipped_segments, percent_clipped
 
 def declip_segments(
         clipped_segments: List[Tuple[int, int]],
-        np_array: np.ndarray
+        np_array: np.ndarray,
+        debug: bool = False,
     ) -> np.ndarray:
     """
     Uses cubic interpolation to declip audio.
     Returns array same shape as np_array.
+    If debug is True, plot each segment before and after declipping.
     """
     new_array = np_array.copy()  # make copy of original np_array
-    for segment in clipped_segments:
-        start = segment[0]
-        end = segment[1]
-
+    for start, end in clipped_segments:
         # get surrounding true values
-        x_true = list(range(start - 5, start)) + list(range(end + 1, end + 6))
-        y_true = [np_array[i] for i in x_true]
+        x_true = np.r_[start-5:start, end+1:end+6]
+        y_true = np_array[x_true]
 
-        # interpolate
+        # interpolate over the clipped samples only
         interpolation_function = interp1d(x_true, y_true, kind='cubic')
-        x_axis = list(range(start - 5, end + 6))
-        y_axis_new = [ float(int(i)) for i in interpolation_function(x_axis)]
+        x_clipped = np.arange(start, end+1)
+        y_new = np.round(interpolation_function(x_clipped)).astype(np_array.dtype)
 
-        # plot segments
-        y_axis_old = [np_array[i] for i in x_axis]
-        plt.plot(x_axis, y_axis_old,'bo-')
-        plt.plot(x_axis, y_axis_new,'r--')
-        plt.show()
+        if debug:
+            plot_declipped_segment(np_array, new_array, start, end, y_new)
 
         # update new array with new values
-        for i, x in enumerate(x_axis):
-            if start <= x <= end:
-                new_array[x] = y_axis_new[i]
+        new_array[start:end+1] = y_new
 
     return new_array
 
 
+def plot_declipped_segment(
+        np_array: np.ndarray,
+        new_array: np.ndarray,
+        start: int,
+        end: int,
+        y_new: np.ndarray,
+    ) -> None:
+    x_axis = np.arange(start-5, end+6)
+    y_axis_new = new_array[x_axis].copy()
+    y_axis_new[5:5+len(y_new)] = y_new
+    plt.plot(x_axis, np_array[x_axis],'bo-')
+    plt.plot(x_axis, y_axis_new,'r--')
+    plt.show()
+
+
 def plot_special_segment(np_array):
     x_axis = list(range(int(2.920125*48000), int(2.926043*48000)))
     y_axis = [np_array[i] for i in x_axis]
@@ -133,26 +206,46 @@ def declip_script():
     # save new wav file
     save_file(sample_rate, new_array, args.new_path)
 
+def _walk_wavs(dirpath: str) -> Iterator[str]:
+    """
+    Recursively yield paths of .wav files under dirpath using os.scandir.
+    Matches the os.walk this replaced: the extension must be exactly '.wav'
+    and symlinked directories are not followed.
+    """
+    try:
+        it = os.scandir(dirpath)
+    except OSError:
+        # skip unreadable or vanished directories, as os.walk does
+        return
+    with it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                yield from _walk_wavs(entry.path)
+            elif os.path.splitext(entry.name)[1] == '.wav':
+                yield entry.path
+
+def _scan_one(fpath: str) -> Tuple[str, float]:
+    """
+    Return (fpath, percent_clipped) for a single wav file.
+    """
+    _, samples = read(fpath)  # int16 samples, compared on native dtype
+    return fpath, get_percent_clipped(samples)
+
 def main(argv: Optional[Sequence[str]]=None) -> int:
     parser = argparse.ArgumentParser(prog='Detect audio clipping')
     parser.add_argument('WAVS_DIR', help='Dirpath for wav files to perform clipping detection on.')
     parser.add_argument('OUT_DIR', help='Dirpath to create clipping_data.csv in.')
+    parser.add_argument('--num_procs', '-n', type=int, default=None,
+                        help='Number of worker processes. If None, use os.cpu_count().')
     args = parser.parse_args(argv)
 
-    df=pd.DataFrame(columns=['filepath', 'percent_clipped'])
-
-    for dirpath, _, filenames in tqdm(list(os.walk(args.WAVS_DIR))):
-        for f in filenames:
-            if os.path.splitext(f)[1] != '.wav':
-                continue
-            fpath = os.path.join(dirpath, f)
-            _, samples = read(fpath)
-            np_array = np.array(samples, dtype=float)  # load int16 wav file
-            _, percent_clipped = get_segments(np_array)
-            df.loc[len(df)] = {
-                'filepath': fpath,
-                'percent_clipped': percent_clipped,
-            }
+    paths = list(_walk_wavs(args.WAVS_DIR))
+
+    with Pool(args.num_procs) as p:
+        rows = list(tqdm(p.imap_unordered(_scan_one, paths, chunksize=32), total=len(paths)))
+    # imap_unordered returns rows in completion order, sort for a stable csv
+    rows.sort()
+    df = pd.DataFrame(rows, columns=['filepath', 'percent_clipped'])
     
     outpath = os.path.join(args.OUT_DIR, 'clipping_data.csv')
     df.to_csv(outpath, index=False)
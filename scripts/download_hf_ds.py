@@ -1,21 +1,28 @@
 #!usr/bin/python3
 
 from typing import Sequence, Optional, Literal, Union
+from concurrent.futures import ThreadPoolExecutor
 import os
+import shutil
+import tempfile
 
 from argparse import ArgumentParser
-from datasets import load_dataset, DatasetDict, Dataset
+from datasets import load_dataset, Audio, DatasetDict, Dataset, IterableDataset, IterableDatasetDict
 from huggingface_hub import login, HfFolder
+import pandas as pd
 import soundfile
 
 """
 Author: Mark Simmons
 
 Downloads a dataset at DATASET_URL from huggingface.
-Check if user has token stored in cache, if not prompts user to login.
+Check if user has token set in HF_TOKEN or stored in cache, if not prompts user to login.
 Saves dataset to LOCAL_PATH.
 """
 
+# number of streamed rows held in memory at once when writing JSON or CSV
+STREAM_BATCH_SIZE = 10000
+
 def can_make_dir(parser: ArgumentParser, arg: str) -> str:
     """
     Return error if directory path cannot be made, return filepath otherwise.
@@ -44,17 +51,101 @@ def init_args(parser: ArgumentParser) -> None:
         choices=['CSV', 'JSON', 'DIR'],
         help='Format to save dataset to. If None, use dataset.save_to_disk().'
     )
+    add_arg(
+        '--streaming',
+        '-s',
+        action='store_true',
+        help='Stream the dataset instead of downloading it to the cache before saving.'
+    )
+
+def undecode_audio(data: IterableDataset) -> IterableDataset:
+    """
+    Cast every Audio feature of a streamed split to Audio(decode=False), so rows keep
+    the {'bytes', 'path'} encoding of the non-streaming path instead of decoded arrays.
+    """
+    if data.features is None:
+        return data
+    for name, feature in data.features.items():
+        if isinstance(feature, Audio) and feature.decode:
+            data = data.cast_column(name, Audio(sampling_rate=feature.sampling_rate, decode=False))
+    return data
+
+def iterable_to_dataset(data: IterableDataset, cache_dir: str) -> Dataset:
+    """
+    Write a streamed split to an Arrow-backed Dataset in a single pass over the stream.
+    cache_dir should be a fresh directory, so that a copy cached by an earlier run
+    with the same fingerprint is never reused.
+    """
+    def gen():
+        yield from data
+    dataset = Dataset.from_generator(gen, features=data.features, cache_dir=cache_dir)
+    # audio was only left encoded for the copy, saved datasets decode it as usual
+    for name, feature in dataset.features.items():
+        if isinstance(feature, Audio) and not feature.decode:
+            dataset = dataset.cast_column(name, Audio(sampling_rate=feature.sampling_rate))
+    return dataset
+
+def write_iterable(
+        data: IterableDataset,
+        path: str,
+        file_type: Literal['JSON', 'CSV'],
+        batch_size: int = STREAM_BATCH_SIZE,
+    ) -> str:
+    """
+    Write a streamed split straight to path as JSON lines or CSV, one batch at a time,
+    without going through an Arrow copy in the datasets cache.
+    """
+    if file_type not in ('JSON', 'CSV'):
+        raise ValueError(f"file_type must be 'JSON' or 'CSV', {file_type=}")
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        for i, batch in enumerate(data.iter(batch_size=batch_size)):
+            df = pd.DataFrame(batch)
+            if file_type=='JSON':
+                lines = df.to_json(orient='records', lines=True, force_ascii=False)
+                f.write(lines if lines.endswith('\n') else lines+'\n')
+            else:
+                df.to_csv(f, header=(i==0), index=False)
+    return path
 
 def save_dataset(
-        data: Union[DatasetDict, Dataset],
+        data: Union[DatasetDict, Dataset, IterableDatasetDict, IterableDataset],
         path: str,
         file_type: Literal['JSON', 'CSV', None] = None,
     ) -> str:
+    if file_type == 'DIR':
+        return make_splitdir(data, path)
+    if type(data) is IterableDataset:
+        data = undecode_audio(data)
+    elif type(data) is IterableDatasetDict:
+        data = IterableDatasetDict({split: undecode_audio(split_data) for split, split_data in data.items()})
+    if file_type is not None:
+        if type(data) is IterableDataset:
+            return write_iterable(data, path, file_type)
+        if type(data) is IterableDatasetDict:
+            for split, split_data in data.items():
+                split_path = os.path.join(path, split)
+                print(f"Saving {split=} to {split_path}")
+                write_iterable(split_data, split_path, file_type)
+            return path
+    if type(data) in (IterableDataset, IterableDatasetDict):
+        # save_to_disk needs an Arrow-backed dataset, build it in a scratch
+        # cache under path and remove that copy once it has been saved
+        cache_dir = tempfile.mkdtemp(prefix='.stream_cache_', dir=path)
+        try:
+            if type(data) is IterableDataset:
+                data = iterable_to_dataset(data, cache_dir)
+            else:
+                data = DatasetDict({
+                    split: iterable_to_dataset(split_data, cache_dir)
+                    for split, split_data in data.items()
+                })
+            data.save_to_disk(path)
+        finally:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+        return path
     if file_type is None:
         data.save_to_disk(path)
         return path
-    elif file_type == 'DIR':
-        return make_splitdir(data, path)
     if type(data) is Dataset:
         if file_type=='JSON':
             data.to_json(path)
@@ -71,16 +162,30 @@ def save_datasetdict(
         data: DatasetDict,
         path: str,
         file_type: Literal['JSON', 'CSV'],
+        num_proc: Optional[int] = None,
     ) -> str:
-    for split, split_data in data.items():
+    """
+    Save each split of data to path, writing all splits concurrently.
+    num_proc processes (os.cpu_count() if None) are shared between the split writers.
+    """
+    if file_type not in ('JSON', 'CSV'):
+        raise ValueError(f"file_type must be 'JSON' or 'CSV', {file_type=}")
+    if len(data) == 0:
+        return path
+    num_proc = max(1, (num_proc or os.cpu_count()) // len(data))
+
+    def save_split(split: str, split_data: Dataset) -> None:
         split_path = os.path.join(path, split)
         print(f"Saving {split=} to {split_path}")
         if file_type=='JSON':
-            split_data.to_json(split_path)
-        elif file_type=='CSV':
-            split_data.to_csv(split_path)
+            split_data.to_json(split_path, num_proc=num_proc)
         else:
-            raise ValueError(f"file_type must be 'JSON' or 'CSV', {file_type=}")
+            split_data.to_csv(split_path, num_proc=num_proc)
+
+    with ThreadPoolExecutor(max_workers=len(data)) as ex:
+        futures = [ex.submit(save_split, split, split_data) for split, split_data in data.items()]
+        for future in futures:
+            future.result()
 
     return path
 
@@ -97,23 +202,33 @@ def make_splitdir(data: DatasetDict, path: str) -> dict:
         os.mkdir(split_dir)
         split_fp = os.path.join(path, split+'.txt')
         with open(split_fp, 'w') as f:
-            def save_split(row: dict) -> None:
+            # plain loop so this works for streamed splits too, where .map is lazy
+            for row in split_data:
                 record_path = row['audio']['path']
                 f.write(record_path+'\n')
                 save_audio(row, split_dir)
-            split_data.map(save_split)
-
-def main(argv: Optional[Sequence[str]] = None) -> int:
-    parser = ArgumentParser("Download HuggingFace Dataset")
-    init_args(parser)
-    args = parser.parse_args(argv)
 
+def get_token() -> str:
+    """
+    Return the HuggingFace token from the environment or the local cache,
+    only prompting the user to login if neither has one.
+    """
+    token = os.environ.get('HF_TOKEN') or os.environ.get('HUGGING_FACE_HUB_TOKEN')
+    if token:
+        return token
     token = HfFolder.get_token()
     while not token:
         login()
         token = HfFolder.get_token()
+    return token
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = ArgumentParser("Download HuggingFace Dataset")
+    init_args(parser)
+    args = parser.parse_args(argv)
 
-    data = load_dataset(args.DATASET_URL)
+    token = get_token()
+    data = load_dataset(args.DATASET_URL, streaming=args.streaming, token=token)
     save_dataset(data, args.LOCAL_PATH, args.type)
 
     return 0
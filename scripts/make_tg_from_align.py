@@ -2,6 +2,7 @@ from pympi import Praat
 from typing import Optional, Sequence
 from argparse import ArgumentParser
 import numpy as np
+import mmap
 import os
 
 def init_args(parser: ArgumentParser) -> None:
@@ -19,13 +20,12 @@ def make_textgrid(
         outdir: str,
 ) -> None:
     outpath = os.path.join(outdir, seq+'.TextGrid')
-    prev = None
-    tg = Praat.TextGrid(xmax=boundaries[-1])
+    times = np.asarray(boundaries).tolist()
+    tg = Praat.TextGrid(xmax=times[-1])
     tier = tg.add_tier('phoneme_gold')
-    for time in boundaries:
-        if prev is not None:
-            tier.add_interval(prev, time, '')
-        prev = time
+    # boundaries are sorted, so the intervals cannot overlap and are set
+    # directly rather than checked one by one by add_interval
+    tier.intervals = [(begin, end, '') for begin, end in zip(times[:-1], times[1:])]
     tg.to_file(outpath)
 
 def main(argv: Optional[Sequence[str]] = None) -> int:
@@ -33,19 +33,23 @@ def main(argv: Optional[Sequence[str]] = None) -> int:
     init_args(parser)
     args = parser.parse_args(argv)
     seqnums = args.seqnums
-    with open(args.ALIGNMENT) as f:
-        line = f.readline()
-        while line:
-            data = line.split()
+    if os.path.getsize(args.ALIGNMENT) == 0:
+        return 0
+    # map the file and let mmap.readline find line ends, avoiding the
+    # buffering of a text file object
+    with open(args.ALIGNMENT, 'rb') as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for line in iter(mm.readline, b''):
+            data = line.decode().split(None, 1)
+            if not data:
+                continue
             seq = data[0]
-            labels = [int(x) for x in data[1:]]
-            if (not seqnums) or (seq in seqnums):
-                diff = np.diff(labels)
-                nonzero_diff = np.where(diff!=0)
-                nonzero_idcs = nonzero_diff[0]+1
-                boundaries = nonzero_idcs/100
+            if len(data) > 1 and ((not seqnums) or (seq in seqnums)):
+                # parse the labels in C rather than with int() per token
+                labels = np.fromstring(data[1], dtype=np.int32, sep=' ')
+                nonzero_idcs = np.flatnonzero(np.diff(labels)) + 1
+                boundaries = nonzero_idcs / 100
                 make_textgrid(boundaries, seq, args.OUTDIR)
-            line = f.readline()
 
 
 if __name__ == '__main__':
@@ -1,49 +1,157 @@
-from typing import Sequence
-from scipy.io import wavfile
+from typing import Iterator, Optional, Sequence, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from fractions import Fraction
+from functools import lru_cache, partial
+import os
 import scipy.signal as sps
+import numpy as np
 from datasets import Audio, Dataset
 import soundfile
 from pathlib import Path
 from tqdm import tqdm
-from glob import glob
+
+try:
+    import soxr
+except ImportError:
+    soxr = None
 
 AUDIO_PATH = r'C:\projects\hCPC\data\tira-asr\himidan'
 RESAMPLED_PATH = r'C:\projects\hCPC\data\tira-asr-resampled'
 
-def resample_scipy(audio_fps: Sequence[str], out_dir: str, new_sr: int = 16000):
-    # taken from Jeremy Cochoy and Rachid Riad
+@lru_cache(maxsize=None)
+def get_up_down(old_sr: int, new_sr: int) -> Tuple[int, int]:
+    """
+    Return the (up, down) polyphase factors to go from old_sr to new_sr.
+    """
+    ratio = Fraction(new_sr, old_sr).limit_denominator(1000)
+    return ratio.numerator, ratio.denominator
+
+def write_wav(out_fp: Path, array: np.ndarray, sr: int) -> None:
+    """
+    Write array to out_fp as PCM_16 through a temporary file in the same
+    directory, so an interrupted run never leaves a truncated output that
+    is_up_to_date would take as done.
+    """
+    tmp_fp = out_fp.with_name(f'.{out_fp.name}.{os.getpid()}.tmp')
+    try:
+        soundfile.write(str(tmp_fp), array, sr, subtype='PCM_16', format='WAV')
+        os.replace(tmp_fp, out_fp)
+    except BaseException:
+        tmp_fp.unlink(missing_ok=True)
+        raise
+
+def read_int16(audio_fp: str) -> Tuple[np.ndarray, int]:
+    """
+    Read audio_fp as int16 samples. soundfile does not rescale FLOAT/DOUBLE
+    files when asked for int16, so those are read as float32 and scaled here.
+    """
+    if soundfile.info(audio_fp).subtype in ('FLOAT', 'DOUBLE'):
+        array, sr = soundfile.read(audio_fp, dtype='float32', always_2d=False)
+        array = np.clip(np.round(array * 32768), -32768, 32767).astype(np.int16)
+        return array, sr
+    return soundfile.read(audio_fp, dtype='int16', always_2d=False)
+
+def _walk_wavs(dirpath: str) -> Iterator[str]:
+    """
+    Recursively yield paths of .wav files under dirpath using os.scandir.
+    Matches the glob this replaced on Windows: the extension is compared
+    case-insensitively and symlinked directories are followed.
+    """
+    try:
+        it = os.scandir(dirpath)
+    except OSError:
+        # skip unreadable or vanished directories, as glob does
+        return
+    with it:
+        for entry in it:
+            if entry.is_dir():
+                yield from _walk_wavs(entry.path)
+            elif entry.name.lower().endswith('.wav'):
+                yield entry.path
+
+def is_up_to_date(audio_fp: str, out_dir: str) -> bool:
+    """
+    Return True if out_dir already has a non-empty output for audio_fp
+    that is newer than the source file.
+    """
+    out_fp = Path(out_dir)/Path(audio_fp).name
+    try:
+        out_stat = out_fp.stat()
+    except FileNotFoundError:
+        return False
+    return out_stat.st_size > 0 and out_stat.st_mtime >= os.stat(audio_fp).st_mtime
+
+def _resample_one(audio_fp: str, out_dir: str, new_sr: int) -> None:
+    # originally taken from Jeremy Cochoy and Rachid Riad
     # https://stackoverflow.com/questions/30619740/downsampling-wav-audio-file
-    for audio_fp in tqdm(audio_fps, desc='Resampling using scipy signal...'):
-        old_sr, array = wavfile.read(audio_fp)
-        num_samples = round(len(array) * float(new_sr) / old_sr)
-        resampled = sps.resample(array, num=num_samples)
-        audio_filename = Path(audio_fp).name
-        out_fp = out_dir/audio_filename
-        soundfile.write(str(out_fp), resampled, new_sr)
+    # now uses polyphase filtering instead of an FFT over the whole file
+    audio_filename = Path(audio_fp).name
+    out_fp = Path(out_dir)/audio_filename
+    if is_up_to_date(audio_fp, out_dir):
+        return
+    # read in the worker so file I/O runs in parallel and no samples are pickled
+    array, old_sr = read_int16(audio_fp)
+    if old_sr == new_sr:
+        write_wav(out_fp, array, new_sr)
+        return
+    if soxr is not None:
+        # SIMD bandlimited resampler, keeps the int16 dtype of the input
+        resampled = soxr.resample(array, old_sr, new_sr, quality='HQ')
+    else:
+        # float32 halves the FIR cost compared to the default float64 upcast
+        up, down = get_up_down(old_sr, new_sr)
+        resampled = sps.resample_poly(np.asarray(array, dtype=np.float32), up, down, axis=0)
+        # filter ringing can overshoot full scale, clip before casting back
+        resampled = np.clip(np.round(resampled), -32768, 32767).astype(np.int16)
+    write_wav(out_fp, resampled, new_sr)
+
+def resample_scipy(
+        audio_fps: Sequence[str],
+        out_dir: str,
+        new_sr: int = 16000,
+        executor: Optional[ProcessPoolExecutor] = None,
+    ):
+    """
+    Read and resample each file in a worker process of executor. If executor
+    is None, a pool with os.cpu_count() workers is created for this call.
+    """
+    if executor is None:
+        with ProcessPoolExecutor(max_workers=os.cpu_count()) as ex:
+            return resample_scipy(audio_fps, out_dir, new_sr, executor=ex)
+    resample_one = partial(_resample_one, out_dir=out_dir, new_sr=new_sr)
+    list(tqdm(
+        executor.map(resample_one, audio_fps),
+        total=len(audio_fps),
+        desc='Resampling using scipy signal...',
+    ))
 
 def resample_hf(audio_fps: Sequence[str], out_dir: str, new_sr: int = 16000):
     print('Resampling using HuggingFace datasets...')
     audio_ds = Dataset.from_dict({'audio': audio_fps}).cast_column('audio', Audio(sampling_rate=new_sr))
     print('Saving output...')
-    def save_audio(row: dict) -> None:
-        audio_name = Path(row['audio']['path']).name
-        out_path = out_dir/audio_name
+    # iterate lazily so each file is decoded, resampled and written one at
+    # a time instead of caching every resampled array to Arrow with .map
+    for row in tqdm(audio_ds.to_iterable_dataset(), total=len(audio_fps)):
         audio = row['audio']
-        audio_array = audio['array']
-        sample_rate = audio['sampling_rate']
-        soundfile.write(str(out_path), audio_array, samplerate=sample_rate)
-    audio_ds.map(save_audio)
+        audio_name = Path(audio['path']).name
+        out_path = Path(out_dir)/audio_name
+        write_wav(out_path, audio['array'], audio['sampling_rate'])
 
     return audio_ds
 
 def main():
-    audio_fps = glob(AUDIO_PATH+'\\**\\*.wav', recursive=True)
+    audio_fps = list(_walk_wavs(AUDIO_PATH))
     scipy_path = Path(RESAMPLED_PATH)/'scipy\\'
     hf_path = Path(RESAMPLED_PATH)/'hf\\'
     scipy_path.mkdir(exist_ok=True)
     hf_path.mkdir(exist_ok=True)
-    resample_scipy(audio_fps, scipy_path)
-    resample_hf(audio_fps, hf_path)
+    # resumable: skip files each backend has already resampled
+    scipy_fps = [fp for fp in audio_fps if not is_up_to_date(fp, scipy_path)]
+    hf_fps = [fp for fp in audio_fps if not is_up_to_date(fp, hf_path)]
+    # one pool for the whole run, spawning workers is expensive on Windows
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as ex:
+        resample_scipy(scipy_fps, scipy_path, executor=ex)
+    resample_hf(hf_fps, hf_path)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
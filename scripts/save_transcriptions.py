@@ -1,5 +1,7 @@
-from datasets import DatasetDict
-from typing import Mapping
+from datasets import Audio, Dataset, DatasetDict
+from typing import Mapping, Tuple
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 ACUTE = '\u0301'
@@ -13,27 +15,54 @@ OTHER_CHARS_TO_EXCLUDE = ["´", "̊", "̋", "̏", "̯", "̺", "͡",]
 
 DATA_DIR = '/mnt/cube/home/AD/mjsimmons/hCPC/data/tira-asr/himidan'
 ASR = '/mnt/cube/home/AD/mjsimmons/markjosims/tira-asr'
+WRITE_THREADS = 32
 
+_STRIP_TABLE = str.maketrans('', '', ''.join(TONES + OTHER_CHARS_TO_EXCLUDE))
+_MARK_SET = frozenset(TONES + OTHER_CHARS_TO_EXCLUDE)
+
+@lru_cache(maxsize=65536)
 def strip_tone(text: str) -> str:
-    for t in TONES:
-        text = text.replace(t, '')
-    for c in OTHER_CHARS_TO_EXCLUDE:
-        text = text.replace(c, '')
-    return text
+    # quick check: most lines have no marks to strip, skip rewriting them
+    if _MARK_SET.isdisjoint(text):
+        return text
+    return text.translate(_STRIP_TABLE)
 
-def save_transcription_file(row: Mapping, split_dir: str) -> None:
+def get_transcription(row: Mapping, split_dir: str) -> Tuple[str, bytes]:
+    """
+    Return the .lab path for row and its processed transcription as utf-8 bytes.
+    """
     text = row['sentence']
     processed_text = strip_tone(text) # may end up needing more processing
     
     filename = row['audio']['path']
     filestem = Path(filename).stem
     savepath = str(split_dir/filestem)+'.lab'
-    with open(savepath, 'w') as f:
-        f.write(processed_text)
+    return savepath, processed_text.encode('utf-8')
+
+def write_transcription(savepath: str, data: bytes) -> None:
+    # binary file: the encoded transcription fits in the buffer, so it is
+    # still flushed with a single write() and no text-layer encoding
+    with open(savepath, 'wb') as f:
+        f.write(data)
+
+def save_transcription_file(row: Mapping, split_dir: str) -> None:
+    write_transcription(*get_transcription(row, split_dir))
     
 
+def save_split_transcriptions(split_ds: Dataset, split_dir: str) -> None:
+    # only the audio path is needed, so skip decoding the wavs and iterate
+    # the rows directly rather than through the Arrow cache of .map
+    split_ds = split_ds.select_columns(['sentence', 'audio'])\
+        .cast_column('audio', Audio(decode=False))
+    # process every row first, then drain all writes in a single pass
+    transcriptions = [get_transcription(row, split_dir) for row in split_ds]
+    # writes are bound by file metadata syscall latency, which release the
+    # GIL, so more threads than cores overlap them
+    with ThreadPoolExecutor(max_workers=WRITE_THREADS) as ex:
+        list(ex.map(lambda t: write_transcription(*t), transcriptions))
+
 if __name__ == '__main__':
     ds = DatasetDict.load_from_disk(ASR)
     for split, split_ds in ds.items():
         split_dir = Path(DATA_DIR)/split
-        split_ds.map(lambda row: save_transcription_file(row, split_dir))
\ No newline at end of file
+        save_split_transcriptions(split_ds, split_dir)
\ No newline at end of file